@@ -0,0 +1,364 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import fffs
+
+# Benchmarks for fffs.Filesystem, and for ffuse.FuseAdapter called directly
+# (no kernel mount).  Every dataset is derived from --seed so two runs with the
+# same arguments do the same work, and results are written as JSON so runs of
+# different versions can be compared.
+#
+#   python benchmark.py --scale 1 --output results.json
+
+READ_SIZE = 4096
+
+class Timer:
+    def __init__(self):
+        self.seconds = 0
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.time() - self.start
+
+def result(name, ops, seconds, **extra):
+    r = dict(name=name, ops=ops, seconds=seconds,
+             ops_per_sec=(ops / seconds if seconds > 0 else None))
+    r.update(extra)
+    return r
+
+def deep_size(roots):
+    # bytes held by roots and everything they reach through containers and
+    # instance attributes, counting each object once
+    seen = set()
+    stack = list(roots)
+    total = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        if hasattr(o, "__dict__"):
+            stack.append(o.__dict__)
+    return total
+
+def rss_bytes():
+    # current resident set size; falls back to peak RSS where /proc is missing
+    try:
+        with open("/proc/self/statm") as fd:
+            return int(fd.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+@contextlib.contextmanager
+def quiet():
+    # ffuse prints on every call; keep that out of the timings and the output
+    saved = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = saved
+
+class Dataset:
+    "synthetic names and data files, reproducible from a seed"
+    def __init__(self, data_dir, seed):
+        self.data_dir = data_dir
+        self.random = random.Random(seed)
+        self.data_files = {}
+
+    def name(self, i):
+        return "n%d-%x" % (i, self.random.getrandbits(32))
+
+    def data_file(self, size):
+        if size not in self.data_files:
+            path = os.path.join(self.data_dir, "data-%d" % size)
+            with open(path, "wb") as fd:
+                fd.write("".join(chr(self.random.randint(0, 255)) for i in range(min(size, 4096))))
+                fd.write("\0" * max(0, size - 4096))
+            self.data_files[size] = path
+        return self.data_files[size]
+
+def new_fs(data_dir):
+    store = fffs.Store(data_dir)
+    fs = fffs.Filesystem(store)
+    return fs, store.new_image(fs.EMPTY_DIR, False)
+
+def make_deep_path(fs, image, dataset, depth):
+    parts = []
+    for i in range(depth):
+        parts.append(dataset.name(i))
+        image = fs.make_dir(image, "/".join(parts))
+    return image, "/".join(parts)
+
+def bench_deep_tree(data_dir, dataset, scale):
+    depth = 100 * scale
+    fs, image = new_fs(data_dir)
+    with Timer() as t:
+        make_deep_path(fs, image, dataset, depth)
+    return result("fs.deep_tree", depth, t.seconds, depth=depth)
+
+def bench_wide_tree(data_dir, dataset, scale):
+    width = 1000 * scale
+    fs, image = new_fs(data_dir)
+    with Timer() as t:
+        for i in range(width):
+            image = fs.make_dir(image, dataset.name(i))
+    return result("fs.wide_tree", width, t.seconds, width=width)
+
+def bench_many_files_one_dir(data_dir, dataset, scale):
+    count = 1000 * scale
+    fs, image = new_fs(data_dir)
+    image = fs.make_dir(image, "d")
+    path = dataset.data_file(100)
+    with Timer() as t:
+        for i in range(count):
+            image = fs.set_file(image, "d/" + dataset.name(i), path)
+    return result("fs.many_files_one_dir", count, t.seconds, files=count)
+
+def bench_path_resolution(data_dir, dataset, scale):
+    depth = 50
+    lookups = 2000 * scale
+    fs, image = new_fs(data_dir)
+    image, vpath = make_deep_path(fs, image, dataset, depth)
+    with Timer() as t:
+        for i in range(lookups):
+            fs.get_entry(image, vpath)
+    return result("fs.path_resolution", lookups, t.seconds, depth=depth)
+
+def bench_path_resolution_presplit(data_dir, dataset, scale):
+    depth = 50
+    lookups = 2000 * scale
+    fs, image = new_fs(data_dir)
+    image, vpath = make_deep_path(fs, image, dataset, depth)
+    vpath = fffs.VPath(vpath)
+    with Timer() as t:
+        for i in range(lookups):
+            fs.get_entry(image, vpath)
+    return result("fs.path_resolution_presplit", lookups, t.seconds, depth=depth)
+
+def bench_memory_per_entry(data_dir, dataset, scale):
+    # a tree of fanout x fanout files, built one file at a time as ffuse would.
+    # Memory is the size of every object the store holds, measured directly
+    # rather than as an RSS delta, which moves with whatever else the process
+    # has allocated or freed
+    fanout = int(60 * scale ** 0.5)
+    fs, image = new_fs(data_dir)
+    path = dataset.data_file(100)
+    with Timer() as t:
+        for i in range(fanout):
+            dir_name = dataset.name(i)
+            image = fs.make_dir(image, dir_name)
+            for j in range(fanout):
+                image = fs.set_file(image, dir_name + "/" + dataset.name(j), path)
+    entries = fanout * fanout + fanout
+    store = fs.store
+    stored = len(store.dirs) + len(store.files) + len(store.images)
+    size = deep_size([store.dirs, store.files, store.images])
+    return result("fs.memory_per_entry", entries, t.seconds,
+                  store_bytes=size,
+                  bytes_per_entry=float(size) / entries,
+                  stored_objects=stored)
+
+def bench_lazy_store(data_dir, dataset, scale):
+    # build a two level tree on disk, then time reopening the store and loading
+    # past versions of the root through a cache much smaller than the history
+    count = 1000 * scale
+    fanout = int(count ** 0.5)
+    store = fffs.LazyStore(data_dir)
+    fs = fffs.Filesystem(store)
+    image = store.new_image(fs.EMPTY_DIR, False)
+    parents = [dataset.name(i) for i in range(fanout)]
+    for parent in parents:
+        image = fs.make_dir(image, parent)
+    dir_ids = []
+    for i in range(count):
+        image = fs.make_dir(image, parents[i % fanout] + "/" + dataset.name(i))
+        dir_ids.append(image.dir.id)
+    store.close()
+
+    lookups = [dataset.random.choice(dir_ids) for i in range(count)]
+    with Timer() as reopen:
+        store = fffs.LazyStore(data_dir, cache_size=100)
+    with Timer() as t:
+        for id in lookups:
+            store.get_dir(id)
+    rss = rss_bytes()
+    store.close()
+    return result("fs.lazy_store_get_dir", count, t.seconds, dirs=count,
+                  reopen_seconds=reopen.seconds, rss=rss)
+
+@contextlib.contextmanager
+def new_adapter(data_dir):
+    # destroy closes the store, and stops readahead threads if it is turned on,
+    # so nothing runs on into later benchmarks
+    import ffuse
+    with quiet():
+        adapter = ffuse.FuseAdapter(data_dir)
+        adapter.mkdir("/img", 0755)
+    try:
+        yield adapter
+    finally:
+        adapter.destroy("/")
+
+def adapter_write(adapter, path, data):
+    fh = adapter.create(path, 0644)
+    adapter.write(path, data, 0, fh)
+    adapter.release(path, fh)
+
+def bench_fuse_getattr(data_dir, dataset, scale):
+    depth = 50
+    lookups = 2000 * scale
+    path = "/img"
+    with new_adapter(data_dir) as adapter, quiet():
+        for i in range(depth):
+            path += "/" + dataset.name(i)
+            adapter.mkdir(path, 0755)
+        with Timer() as t:
+            for i in range(lookups):
+                adapter.getattr(path)
+    return result("fuse.getattr_deep", lookups, t.seconds, depth=depth)
+
+def bench_fuse_readdir(data_dir, dataset, scale):
+    entries = 1000 * scale
+    calls = 20
+    with new_adapter(data_dir) as adapter, quiet():
+        adapter.mkdir("/img/d", 0755)
+        for i in range(entries):
+            adapter.mkdir("/img/d/" + dataset.name(i), 0755)
+        with Timer() as t:
+            for i in range(calls):
+                names = adapter.readdir("/img/d", None)
+    assert len(names) == entries + 2
+    return result("fuse.readdir_huge", calls, t.seconds, entries=entries)
+
+def bench_fuse_reads(data_dir, dataset, scale):
+    size = 4 * 1024 * 1024 * scale
+    with new_adapter(data_dir) as adapter, quiet():
+        adapter_write(adapter, "/img/seq", "\0" * size)
+        adapter_write(adapter, "/img/rnd", "\0" * size)
+
+        fh = adapter.open("/img/seq", os.O_RDONLY)
+        with Timer() as seq:
+            offset = 0
+            while offset < size:
+                offset += len(adapter.read("/img/seq", READ_SIZE, offset, fh))
+        adapter.release("/img/seq", fh)
+
+        offsets = [dataset.random.randrange(0, size, READ_SIZE) for i in range(size // READ_SIZE)]
+        fh = adapter.open("/img/rnd", os.O_RDONLY)
+        with Timer() as rnd:
+            for offset in offsets:
+                adapter.read("/img/rnd", READ_SIZE, offset, fh)
+        adapter.release("/img/rnd", fh)
+
+    reads = size // READ_SIZE
+    return [result("fuse.sequential_read", reads, seq.seconds, bytes=size,
+                   mb_per_sec=size / seq.seconds / (1024 * 1024)),
+            result("fuse.random_read", reads, rnd.seconds, bytes=size,
+                   mb_per_sec=size / rnd.seconds / (1024 * 1024))]
+
+def bench_fuse_concurrent_writers(data_dir, dataset, scale):
+    writers = 4
+    files_per_writer = 100 * scale
+    names = [[dataset.name(j) for j in range(files_per_writer)] for i in range(writers)]
+
+    def write_files(adapter, i):
+        for name in names[i]:
+            adapter_write(adapter, "/img/w%d/%s" % (i, name), "x" * 100)
+
+    with new_adapter(data_dir) as adapter, quiet():
+        for i in range(writers):
+            adapter.mkdir("/img/w%d" % i, 0755)
+        threads = [threading.Thread(target=write_files, args=(adapter, i)) for i in range(writers)]
+        with Timer() as t:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        visible = sum(len(adapter.readdir("/img/w%d" % i, None)) - 2 for i in range(writers))
+
+    # only the writes which landed count towards throughput; lost ones are
+    # reported on their own
+    attempted = writers * files_per_writer
+    return result("fuse.concurrent_writers", visible, t.seconds, writers=writers,
+                  attempted=attempted, lost_files=attempted - visible)
+
+FS_BENCHMARKS = [bench_deep_tree, bench_wide_tree, bench_many_files_one_dir,
+                 bench_path_resolution, bench_path_resolution_presplit,
+                 bench_memory_per_entry, bench_lazy_store]
+FUSE_BENCHMARKS = [bench_fuse_getattr, bench_fuse_readdir, bench_fuse_reads,
+                   bench_fuse_concurrent_writers]
+
+def git_version():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(benchmarks, scale, seed, only):
+    results = []
+    for benchmark in benchmarks:
+        if only and not any(o in benchmark.__name__ for o in only):
+            continue
+        data_dir = tempfile.mkdtemp()
+        try:
+            dataset = Dataset(data_dir, seed)
+            r = benchmark(data_dir, dataset, scale)
+        finally:
+            shutil.rmtree(data_dir)
+        if not isinstance(r, list):
+            r = [r]
+        for x in r:
+            sys.stderr.write("%-28s %10.4fs\n" % (x["name"], x["seconds"]))
+        results.extend(r)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="fffs/ffuse benchmarks")
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--no-fuse", action="store_true", help="skip ffuse.FuseAdapter benchmarks")
+    parser.add_argument("only", nargs="*", help="run only benchmarks whose name contains one of these")
+    args = parser.parse_args()
+
+    benchmarks = list(FS_BENCHMARKS)
+    if not args.no_fuse:
+        benchmarks.extend(FUSE_BENCHMARKS)
+
+    report = dict(version=git_version(), python=platform.python_version(),
+                  scale=args.scale, seed=args.seed,
+                  results=run(benchmarks, args.scale, args.seed, args.only))
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(report, fd, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
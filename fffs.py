@@ -6,13 +6,22 @@ __author__ = 'pmontgom'
 #   when making dir, all parent dirs must exist
 #   when creating a dir, all parent dirs must exist
 #   when renaming dir, source must exist and dest must not exist
+import collections
+import mmap
 import os.path
+import struct
+import threading
 
 class Dir:
-    def __init__(self, id, entries):
+    def __init__(self, id, entries, size=0, file_count=0, dir_count=0):
         assert isinstance(id, int)
         self.id = id
         self.entries = entries
+        # totals for the whole subtree below this dir.  Dirs are immutable so
+        # these are computed once, from the children's totals, by Store.new_dir
+        self.size = size
+        self.file_count = file_count
+        self.dir_count = dir_count
 
     def get_entry(self, name):
         m = [x for x in self.entries if x.name == name]
@@ -37,6 +46,46 @@ class DirEntry:
         self.type = type
         self.id = id
 
+# names are held as byte strings in this encoding.  fusepy hands us unicode
+# paths, which VPath encodes before splitting
+ENCODING = "utf-8"
+
+class VPath(str):
+    # a vpath split once into interned components.  Still compares and hashes
+    # as the original string, so it can be passed anywhere a vpath is taken.
+    # parts matches Filesystem.split; parent/basename match os.path.split,
+    # except that an empty parent is reported as "."
+    def __new__(cls, path):
+        if isinstance(path, VPath):
+            return path
+        if isinstance(path, unicode):
+            path = path.encode(ENCODING)
+        if path.startswith("/"):
+            parts = path.split("/")
+        else:
+            parts = ("./" + path).split("/")
+        return cls._from_parts(path, tuple(map(intern, parts)))
+
+    @classmethod
+    def _from_parts(cls, path, parts):
+        self = str.__new__(cls, path)
+        self.parts = parts
+        self.basename = parts[-1]
+        self._parent = None
+        return self
+
+    @property
+    def parent(self):
+        if self._parent is None:
+            i = self.rfind("/")
+            if i > 0:
+                self._parent = VPath._from_parts(self[:i], self.parts[:-1])
+            elif i == 0:
+                self._parent = VPath("/")
+            else:
+                self._parent = VPath(".")
+        return self._parent
+
 class Image:
     def __init__(self, id, dir, is_frozen):
         assert isinstance(id, int)
@@ -64,6 +113,8 @@ class Store:
         self.files[file.id] = file
     def store_image(self, image):
         self.images[image.id] = image
+    def close(self):
+        pass
     def new_id(self):
         n = self.next_id
         self.next_id += 1
@@ -73,8 +124,24 @@ class Store:
         f = Image(self.new_id(), dir, is_frozen)
         self.store_image(f)
         return f
-    def new_dir(self, entries):
-        f = Dir(self.new_id(), entries)
+    def new_dir(self, entries, totals=None):
+        "totals is (bytes, file count, dir count); computed from the children if not given"
+        if totals is None:
+            size = 0
+            file_count = 0
+            dir_count = 0
+            for entry in entries:
+                if entry.type == DIR_TYPE:
+                    child = self.get_dir(entry.id)
+                    size += child.size
+                    file_count += child.file_count
+                    dir_count += child.dir_count + 1
+                else:
+                    size += self.get_file(entry.id).size
+                    file_count += 1
+        else:
+            size, file_count, dir_count = totals
+        f = Dir(self.new_id(), entries, size, file_count, dir_count)
         self.store_dir(f)
         return f
     def new_file(self, path):
@@ -84,6 +151,203 @@ class Store:
         self.store_file(f)
         return f
 
+INDEX_SLOT = struct.Struct("<Q")
+RECORD_HEADER = struct.Struct("<Ic")
+DIR_HEADER = struct.Struct("<qqqqI")
+DIR_ENTRY_HEADER = struct.Struct("<qcH")
+FILE_HEADER = struct.Struct("<qqH")
+IMAGE_RECORD = struct.Struct("<qq?")
+IMAGE_KIND = "I"
+EMPTY_DIR_ID = 1
+
+class MappedFile:
+    # read-only mmap of a file which is only ever appended to.  The mapping is
+    # re-created when a read reaches past the end of what was mapped.
+    def __init__(self, path):
+        self.path = path
+        self.map = None
+
+    def view(self, end):
+        "returns a mapping covering at least [0, end), or None if the file is shorter"
+        if self.map is None or len(self.map) < end:
+            size = os.path.getsize(self.path)
+            if size < end:
+                return None
+            if self.map is not None:
+                self.map.close()
+            with open(self.path, "rb") as fd:
+                self.map = mmap.mmap(fd.fileno(), size, access=mmap.ACCESS_READ)
+        return self.map
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+class RecordLog:
+    # records, each prefixed with its length and kind, appended to <name>.dat.
+    # <name>.idx has one slot per id holding the offset of that id's record
+    # plus one (0 for ids which were never stored), so a lookup is a single
+    # read of each mmap'd file.  Every kind shares the one id space, so the
+    # index stays dense
+    def __init__(self, data_path, name):
+        data_file = os.path.join(data_path, name + ".dat")
+        index_file = os.path.join(data_path, name + ".idx")
+        if not os.path.exists(index_file):
+            open(index_file, "wb").close()
+        self.data_fd = open(data_file, "ab")
+        self.index_fd = open(index_file, "r+b")
+        self.data = MappedFile(data_file)
+        self.index = MappedFile(index_file)
+        # one past the largest id which could have a record
+        self.id_limit = os.path.getsize(index_file) // INDEX_SLOT.size
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+        self.data_fd.close()
+        self.index_fd.close()
+
+    def get(self, id, kind):
+        slot_end = (id + 1) * INDEX_SLOT.size
+        index = self.index.view(slot_end)
+        if index is None:
+            raise KeyError(id)
+        offset, = INDEX_SLOT.unpack_from(index, slot_end - INDEX_SLOT.size)
+        if offset == 0:
+            raise KeyError(id)
+        offset -= 1
+
+        data = self.data.view(offset + RECORD_HEADER.size)
+        length, record_kind = RECORD_HEADER.unpack_from(data, offset)
+        if record_kind != kind:
+            raise KeyError(id)
+        offset += RECORD_HEADER.size
+        return self.data.view(offset + length)[offset:offset + length]
+
+    def append(self, id, kind, record):
+        self.data_fd.seek(0, os.SEEK_END)
+        offset = self.data_fd.tell()
+        self.data_fd.write(RECORD_HEADER.pack(len(record), kind) + record)
+        self.data_fd.flush()
+        self.index_fd.seek(id * INDEX_SLOT.size)
+        self.index_fd.write(INDEX_SLOT.pack(offset + 1))
+        self.index_fd.flush()
+        self.id_limit = max(self.id_limit, id + 1)
+
+def encode_name(name):
+    if isinstance(name, unicode):
+        return name.encode(ENCODING)
+    return name
+
+class LazyStore(Store):
+    # keeps dirs, files and images on disk, in one RecordLog in data_path, and
+    # only holds recently used ones in memory.  Objects are materialized
+    # on first use and kept in an LRU of at most cache_size entries per kind,
+    # so opening a store reads nothing and memory does not grow with history.
+    # Every store has a single empty dir, EMPTY_DIR_ID, which new_dir([])
+    # returns rather than appending another
+    def __init__(self, data_path, cache_size=100000):
+        Store.__init__(self, data_path)
+        if not os.path.exists(data_path):
+            os.makedirs(data_path)
+        self.dirs = collections.OrderedDict()
+        self.files = collections.OrderedDict()
+        self.images = collections.OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.RLock()
+
+        self.log = RecordLog(data_path, "store")
+
+        # never hand out an id which is already on disk
+        self.next_id = max(self.next_id, self.log.id_limit)
+        if self.log.id_limit <= EMPTY_DIR_ID:
+            assert self.next_id == EMPTY_DIR_ID
+            Store.new_dir(self, [])
+
+    def close(self):
+        self.log.close()
+
+    def _cache(self, cache, object):
+        cache[object.id] = object
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _get(self, cache, load, id):
+        with self.lock:
+            object = cache.pop(id, None)
+            if object is None:
+                object = load(id)
+            self._cache(cache, object)
+            return object
+
+    def _load_dir(self, id):
+        record = self.log.get(id, DIR_TYPE)
+        dir_id, size, file_count, dir_count, entry_count = DIR_HEADER.unpack_from(record, 0)
+        assert dir_id == id
+
+        unpack_entry = DIR_ENTRY_HEADER.unpack_from
+        entry_header_size = DIR_ENTRY_HEADER.size
+        entries = []
+        offset = DIR_HEADER.size
+        for i in range(entry_count):
+            entry_id, type, name_length = unpack_entry(record, offset)
+            offset += entry_header_size
+            # left as encoded bytes, the form VPath.parts compares against
+            name = intern(record[offset:offset + name_length])
+            offset += name_length
+            entries.append(DirEntry(name, type, int(entry_id)))
+        return Dir(int(dir_id), entries, size, file_count, dir_count)
+
+    def _load_file(self, id):
+        record = self.log.get(id, FILE_TYPE)
+        file_id, size, path_length = FILE_HEADER.unpack_from(record, 0)
+        assert file_id == id
+        path = record[FILE_HEADER.size:FILE_HEADER.size + path_length]
+        return File(int(file_id), path, size)
+
+    def _load_image(self, id):
+        image_id, dir_id, is_frozen = IMAGE_RECORD.unpack(self.log.get(id, IMAGE_KIND))
+        assert image_id == id
+        return Image(int(image_id), self.get_dir(int(dir_id)), is_frozen)
+
+    def get_dir(self, id):
+        return self._get(self.dirs, self._load_dir, id)
+
+    def get_file(self, id):
+        return self._get(self.files, self._load_file, id)
+
+    def get_image(self, id):
+        return self._get(self.images, self._load_image, id)
+
+    def new_dir(self, entries, totals=None):
+        if len(entries) == 0:
+            return self.get_dir(EMPTY_DIR_ID)
+        return Store.new_dir(self, entries, totals)
+
+    def store_dir(self, dir):
+        record = [DIR_HEADER.pack(dir.id, dir.size, dir.file_count, dir.dir_count, len(dir.entries))]
+        for entry in dir.entries:
+            name = encode_name(entry.name)
+            record.append(DIR_ENTRY_HEADER.pack(entry.id, entry.type, len(name)))
+            record.append(name)
+        with self.lock:
+            self.log.append(dir.id, DIR_TYPE, "".join(record))
+            self._cache(self.dirs, dir)
+
+    def store_file(self, file):
+        path = encode_name(file.path)
+        record = FILE_HEADER.pack(file.id, file.size, len(path)) + path
+        with self.lock:
+            self.log.append(file.id, FILE_TYPE, record)
+            self._cache(self.files, file)
+
+    def store_image(self, image):
+        record = IMAGE_RECORD.pack(image.id, image.dir.id, image.is_frozen)
+        with self.lock:
+            self.log.append(image.id, IMAGE_KIND, record)
+            self._cache(self.images, image)
+
 DIR_TYPE = "D"
 FILE_TYPE = "F"
 
@@ -101,33 +365,59 @@ class Filesystem:
 
         entries = []
         found_name = False
+        # only the replaced and replacing children change the totals, so
+        # adjust the old dir's totals rather than reading every child
+        size, file_count, dir_count = dir.size, dir.file_count, dir.dir_count
 
         for existing_entry in dir.entries:
             if existing_entry.name == name:
                 if new_value != None:
                     entries.append(DirEntry(name, new_value_type, new_value))
                 found_name = True
+                old_size, old_files, old_dirs = self.entry_totals(existing_entry.type, existing_entry.id)
+                size -= old_size
+                file_count -= old_files
+                dir_count -= old_dirs
             else:
                 entries.append(existing_entry)
 
         if not found_name and new_value != None:
             entries.append(DirEntry(name, new_value_type, new_value))
 
-        return self.store.new_dir(entries)
+        if new_value != None:
+            new_size, new_files, new_dirs = self.entry_totals(new_value_type, new_value)
+            size += new_size
+            file_count += new_files
+            dir_count += new_dirs
+
+        return self.store.new_dir(entries, (size, file_count, dir_count))
+
+    def entry_totals(self, type, id):
+        "returns what an entry adds to its parent's (bytes, file count, dir count)"
+        if type == DIR_TYPE:
+            dir = self.store.get_dir(id)
+            return (dir.size, dir.file_count, dir.dir_count + 1)
+        return (self.store.get_file(id).size, 1, 0)
 
     def get_dirs(self, parent_dir, vpath_parts):
+        if isinstance(vpath_parts, VPath):
+            vpath_parts = vpath_parts.parts
         parent_dirs = []
         for dir_name in vpath_parts:
             if dir_name != ".":
                 de = parent_dir.get_entry(dir_name)
-                assert de != None, "get_entry(%r) on %r returned None" % (dir_name, parent_dir)
+                assert de is not None, "get_entry(%r) on %r returned None" % (dir_name, parent_dir)
                 assert de.type == DIR_TYPE
                 parent_dir = self.store.get_dir(de.id)
-            assert parent_dir != None
+            assert parent_dir is not None
             parent_dirs.append(parent_dir)
         return parent_dirs
 
     def split(self, vpath):
+        if isinstance(vpath, VPath):
+            return vpath.parts
+        if isinstance(vpath, unicode):
+            vpath = vpath.encode(ENCODING)
         if not vpath.startswith("/"):
             vpath = "./" + vpath
         return vpath.split("/")
@@ -195,6 +485,17 @@ class Filesystem:
         assert de.type == DIR_TYPE
         return self.store.get_dir(de.id)
 
+    def du(self, image, vpath):
+        "returns (total bytes, file count, dir count) for everything under vpath"
+        if vpath == ".":
+            dir = image.dir
+        else:
+            de = self.get_entry(image, vpath)
+            if de.type == FILE_TYPE:
+                return self.entry_totals(de.type, de.id)
+            dir = self.store.get_dir(de.id)
+        return (dir.size, dir.file_count, dir.dir_count)
+
     def entry_exists(self, image, vpath):
         return self.get_entry(image, vpath) != None
 
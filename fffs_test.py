@@ -1,4 +1,6 @@
+# -*- coding: utf-8 -*-
 from fffs import *
+from testutil import temp_dir, make_data_file
 
 def test_make_nested_dir():
     fs = Filesystem(Store())
@@ -67,3 +69,161 @@ def test_rename_in_different_dir_2():
     i4 = fs.rename(i3, "dir1/file1", "file1")
     assert fs.entry_exists(i4, "file1")
     assert not fs.entry_exists(i4, "dir1/file1")
+
+
+def test_du():
+    with temp_dir() as data_path:
+        fs = Filesystem(Store(data_path))
+        i1 = Image(fs.new_id(), fs.EMPTY_DIR, False)
+        i2 = fs.make_dir(i1, "dir1")
+        i3 = fs.make_dir(i2, "dir1/dir2")
+        i4 = fs.set_file(i3, "dir1/dir2/file1", make_data_file(data_path, "x" * 10))
+        i5 = fs.set_file(i4, "dir1/file2", make_data_file(data_path, "x" * 5))
+        i6 = fs.set_file(i5, "file3", make_data_file(data_path, "x"))
+        assert fs.du(i6, ".") == (16, 3, 2)
+        assert fs.du(i6, "dir1") == (15, 2, 1)
+        assert fs.du(i6, "dir1/dir2") == (10, 1, 0)
+        assert fs.du(i6, "file3") == (1, 1, 0)
+        assert fs.du(i3, ".") == (0, 0, 2)
+
+def test_du_after_unlink():
+    with temp_dir() as data_path:
+        fs = Filesystem(Store(data_path))
+        i1 = Image(fs.new_id(), fs.EMPTY_DIR, False)
+        i2 = fs.make_dir(i1, "dir1")
+        i3 = fs.set_file(i2, "dir1/file1", make_data_file(data_path, "x" * 10))
+        i4 = fs.set_file(i3, "dir1/file1", make_data_file(data_path, "x" * 3))
+        assert fs.du(i4, ".") == (3, 1, 1)
+        i5 = fs.unlink(i4, "dir1/file1")
+        assert fs.du(i5, ".") == (0, 0, 1)
+
+class CountingStore(Store):
+    def __init__(self, data_path):
+        Store.__init__(self, data_path)
+        self.reads = 0
+    def get_dir(self, id):
+        self.reads += 1
+        return Store.get_dir(self, id)
+    def get_file(self, id):
+        self.reads += 1
+        return Store.get_file(self, id)
+
+def test_du_clone_reads_only_changed_children():
+    with temp_dir() as data_path:
+        store = CountingStore(data_path)
+        fs = Filesystem(store)
+        image = Image(fs.new_id(), fs.EMPTY_DIR, False)
+        for i in range(100):
+            image = fs.make_dir(image, "d%d" % i)
+            image = fs.set_file(image, "d%d/f" % i, make_data_file(data_path, "x"))
+        store.reads = 0
+        image = fs.make_dir(image, "new")
+        assert store.reads <= 2
+        assert fs.du(image, ".") == (100, 100, 101)
+
+def test_vpath():
+    p = VPath("dir1/dir2/file")
+    assert p == "dir1/dir2/file"
+    assert p.parts == (".", "dir1", "dir2", "file")
+    assert p.basename == "file"
+    assert p.parent == "dir1/dir2"
+    assert p.parent.parent == "dir1"
+    assert p.parent.parent.parent == "."
+    assert VPath(p) is p
+    assert VPath("/a/b").parent == "/a"
+    assert VPath("/a").parent == "/"
+    assert {"dir1/dir2/file": 1}[p] == 1
+
+def test_vpath_lookup():
+    with temp_dir() as data_path:
+        fs = Filesystem(Store(data_path))
+        i1 = Image(fs.new_id(), fs.EMPTY_DIR, False)
+        i2 = fs.make_dir(i1, VPath("dir1"))
+        i3 = fs.set_file(i2, VPath("dir1/file1"), make_data_file(data_path, "data"))
+        assert fs.entry_exists(i3, VPath("dir1/file1"))
+        assert fs.get_entry(i3, VPath("dir1/file1")).id == fs.get_entry(i3, "dir1/file1").id
+        assert list(fs.split(VPath("dir1/file1"))) == fs.split("dir1/file1")
+
+def test_lazy_store_round_trip():
+    with temp_dir() as data_path:
+        store = LazyStore(data_path, cache_size=2)
+        try:
+            fs = Filesystem(store)
+            i1 = Image(fs.new_id(), fs.EMPTY_DIR, False)
+            i2 = fs.make_dir(i1, "dir1")
+            i3 = fs.make_dir(i2, "dir1/dir2")
+            i4 = fs.set_file(i3, "dir1/dir2/file1", make_data_file(data_path, "x" * 7))
+            assert len(store.dirs) <= 2
+            assert fs.get_file(i4, "dir1/dir2/file1").size == 7
+            assert fs.du(i4, "dir1") == (7, 1, 1)
+            assert [e.name for e in fs.get_dir(i4, "dir1").entries] == ["dir2"]
+        finally:
+            store.close()
+
+def test_lazy_store_reopen():
+    with temp_dir() as data_path:
+        store = LazyStore(data_path)
+        try:
+            fs = Filesystem(store)
+            i1 = store.new_image(fs.EMPTY_DIR, False)
+            i2 = fs.make_dir(i1, "a")
+            i3 = fs.set_file(i2, "a/f", make_data_file(data_path, "x" * 3))
+            image_id = i3.id
+            next_id = store.next_id
+        finally:
+            store.close()
+
+        store = LazyStore(data_path)
+        try:
+            fs = Filesystem(store)
+            # opening the store again doesn't add another empty dir
+            assert store.next_id == next_id
+            image = store.get_image(image_id)
+            assert fs.get_file(image, "a/f").size == 3
+            image = fs.make_dir(image, "a/b")
+            assert fs.du(image, ".") == (3, 1, 2)
+            assert store.next_id > next_id
+        finally:
+            store.close()
+
+class CountingLazyStore(LazyStore):
+    def __init__(self, data_path, cache_size):
+        LazyStore.__init__(self, data_path, cache_size)
+        self.dir_loads = 0
+    def _load_dir(self, id):
+        self.dir_loads += 1
+        return LazyStore._load_dir(self, id)
+
+def test_lazy_store_clone_of_wide_dir_loads_one_child():
+    with temp_dir() as data_path:
+        store = CountingLazyStore(data_path, cache_size=10)
+        try:
+            fs = Filesystem(store)
+            image = store.new_image(fs.EMPTY_DIR, False)
+            for i in range(200):
+                image = fs.make_dir(image, "d%d" % i)
+                image = fs.make_dir(image, "d%d/e" % i)
+            root = image.dir
+            store.dirs.clear()
+            store.dir_loads = 0
+            image = fs.make_dir(Image(image.id, root, False), "new")
+            assert store.dir_loads <= 1
+            assert fs.du(image, ".") == (0, 0, 401)
+        finally:
+            store.close()
+
+def test_lazy_store_non_ascii_names():
+    with temp_dir() as data_path:
+        store = LazyStore(data_path, cache_size=1)
+        try:
+            fs = Filesystem(store)
+            i1 = Image(fs.new_id(), fs.EMPTY_DIR, False)
+            i2 = fs.make_dir(i1, u"répertoire")
+            i3 = fs.make_dir(i2, u"répertoire/été")
+            dir = store.new_dir([DirEntry(u"fichier é", DIR_TYPE, fs.EMPTY_DIR.id)])
+            store.dirs.clear()
+            assert fs.entry_exists(i3, u"répertoire/été")
+            assert fs.du(i3, u"répertoire") == (0, 0, 1)
+            assert store.get_dir(dir.id).get_entry(u"fichier é".encode(ENCODING)) != None
+        finally:
+            store.close()
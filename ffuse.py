@@ -6,6 +6,7 @@ from stat import S_IFDIR, S_IFLNK, S_IFREG
 from fuse import FUSE, FuseOSError, Operations, LoggingMixIn
 
 import fffs
+import readahead
 
 # TODO: Next step:  mkdir at top level should create a new image
 # add support for rmdir
@@ -85,8 +86,8 @@ class ImagesMount:
         image = self.store.get_image(image_id)
         dir = image.dir #self.fs.get_dir(image, path)
         for entry in dir.entries:
-            names.append(entry.name)
-        names.extend(self.transient_paths.get_files(path, "."))
+            names.append(entry.name.decode(fffs.ENCODING))
+        names.extend(name.decode(fffs.ENCODING) for name in self.transient_paths.get_files(path, "."))
         return names
 
     def getattr(self, path, fh=None):
@@ -96,9 +97,34 @@ class ImagesMount:
             raise FuseOSError(ENOENT)
 
 import collections
+import json
 import os.path
 import uuid
 
+class ImageNames(dict):
+    # image name -> image id map which is rewritten to a json file on every
+    # change, so a LazyStore can be mounted again with its images in place
+    def __init__(self, path):
+        dict.__init__(self)
+        self.path = path
+        if os.path.exists(path):
+            with open(path) as fd:
+                self.update(json.load(fd))
+
+    def __setitem__(self, name, id):
+        dict.__setitem__(self, name, id)
+        self.save()
+
+    def __delitem__(self, name):
+        dict.__delitem__(self, name)
+        self.save()
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as fd:
+            json.dump(self, fd)
+        os.rename(tmp_path, self.path)
+
 class TransientPaths:
     def __init__(self, data_dir):
         self.m = collections.defaultdict(lambda: {})
@@ -108,15 +134,12 @@ class TransientPaths:
         return self.m[(image, path)].keys()
 
     def is_transient_file(self, image, path):
-        parent_dir, filename = os.path.split(path)
-        if parent_dir == '':
-            parent_dir = '.'
-        return filename in self.m[(image, parent_dir)]
+        path = fffs.VPath(path)
+        return path.basename in self.m[(image, path.parent)]
 
     def add(self, image, path):
-        parent, filename = os.path.split(path)
-        if parent == '':
-            parent = "."
+        path = fffs.VPath(path)
+        parent, filename = path.parent, path.basename
         data_file = os.path.join(self.data_dir, str(uuid.uuid4()))
         self.m[(image, parent)][filename] = data_file
 
@@ -124,9 +147,8 @@ class TransientPaths:
         #raise Exception("fail")
 
     def get_size(self, image, path):
-        parent, filename = os.path.split(path)
-        if parent == '':
-            parent = "."
+        path = fffs.VPath(path)
+        parent, filename = path.parent, path.basename
         data_file = self.m[(image, parent)][filename]
         if os.path.exists(data_file):
             size = os.path.getsize(data_file)
@@ -135,9 +157,8 @@ class TransientPaths:
         return size
 
     def write(self, image, path, data, offset, fh):
-        parent, filename = os.path.split(path)
-        if parent == '':
-            parent = "."
+        path = fffs.VPath(path)
+        parent, filename = path.parent, path.basename
         data_file = self.m[(image, parent)][filename]
         if os.path.exists(data_file):
             size = os.path.getsize(data_file)
@@ -152,9 +173,8 @@ class TransientPaths:
         data_file = self.release(image, path)
 
     def release(self, image, path):
-        parent_dir, filename = os.path.split(path)
-        if parent_dir == '':
-            parent_dir = '.'
+        path = fffs.VPath(path)
+        parent_dir, filename = path.parent, path.basename
         data_file = self.m[(image, parent_dir)][filename]
         del self.m[(image, parent_dir)][filename]
         return data_file
@@ -167,7 +187,7 @@ class FffsControl:
 
     def readdir(self, path, fh):
         if path == ".fffs":
-            names = ['.', '..', 'id']
+            names = ['.', '..', 'id', 'du']
             return names
         else:
             raise FuseOSError(ENOTDIR)
@@ -175,7 +195,7 @@ class FffsControl:
     def getattr(self, path, fh=None):
         if path == ".fffs":
             return DIR_ATTRS
-        elif path in ['.fffs/id']:
+        elif path in ['.fffs/id', '.fffs/du']:
             return EMPTY_FILE_ATTRS
         else:
             raise FuseOSError(ENOENT)
@@ -183,6 +203,9 @@ class FffsControl:
     def read(self, path, size, offset, fh):
         if path == ".fffs/id":
             return str(self.images[self.name])[offset:offset+size]
+        elif path == ".fffs/du":
+            image = self.fs.store.get_image(self.images[self.name])
+            return ("%d %d %d\n" % self.fs.du(image, "."))[offset:offset+size]
         else:
             raise FuseOSError(ENOENT)
 
@@ -191,13 +214,14 @@ class FffsControl:
 
 class ImageMount:
     # handles all operations on path "/image/dir*"
-    def __init__(self, fs, image_id, store, images, name, transient_paths):
+    def __init__(self, fs, image_id, store, images, name, transient_paths, readahead):
         self.fs = fs
         self.image_id = image_id
         self.store = store
         self.images = images
         self.name = name
         self.transient_paths = transient_paths
+        self.readahead = readahead
 
     @property
     def image(self):
@@ -230,7 +254,10 @@ class ImageMount:
         self.update_image(new_image)
 
     def read(self, path, size, offset, fh):
-        return self.fs.read(self.image, path, size, offset)
+        if self.readahead is None:
+            return self.fs.read(self.image, path, size, offset)
+        file = self.fs.get_file(self.image, path)
+        return self.readahead.read(fh, file.path, size, offset)
 
     def readdir(self, path, fh):
         names = ['.', '..']
@@ -243,7 +270,7 @@ class ImageMount:
 
         dir = self.store.get_dir(entry.id)
         for entry in dir.entries:
-            names.append(entry.name)
+            names.append(entry.name.decode(fffs.ENCODING))
         return names
 
     def getattr(self, path, fh=None):
@@ -267,7 +294,11 @@ class ImageMount:
                     return mk_file_attrs(file.size)
 
     def open(self, fd, path, flags):
-        pass
+        if self.readahead is None or self.transient_paths.is_transient_file(self.name, path):
+            return
+        entry = self.fs.get_entry(self.image, path)
+        if entry != None and entry.type == fffs.FILE_TYPE:
+            self.readahead.open(fd, self.store.get_file(entry.id).path)
 
     def create(self, fd, path, flags, fi):
         #self.transient_paths[fd] = path
@@ -285,6 +316,8 @@ class ImageMount:
             self.transient_paths.rm(self.name, path)
 
     def release(self, path, fh):
+        if self.readahead is not None:
+            self.readahead.release(fh)
         if self.transient_paths.is_transient_file(self.name, path):
             filename = self.transient_paths.release(self.name, path)
             image_id = self.images[self.name]
@@ -294,15 +327,23 @@ class ImageMount:
 
 
 class FuseAdapter(LoggingMixIn, Operations):
-    def __init__(self):
-        self.store = fffs.Store("datafiles")
+    def __init__(self, data_path="datafiles", lazy_dirs=False, use_readahead=False):
+        if lazy_dirs:
+            self.store = fffs.LazyStore(data_path)
+            self.images = ImageNames(os.path.join(data_path, "images.json"))
+        else:
+            self.store = fffs.Store(data_path)
+            self.images = {}
         self.fs = fffs.Filesystem(self.store)
 
         self.now = time.time()
-        self.images = {}
         self.root_mount = RootMount(self.images)
         self.transient_paths = TransientPaths(self.store.data_path)
         self.images_mount = ImagesMount(self.fs, self.images, self.store, self.transient_paths)
+        if use_readahead:
+            self.readahead = readahead.Readahead()
+        else:
+            self.readahead = None
         self.next_fd = 0
 
     def get_delegate(self, path):
@@ -317,9 +358,10 @@ class FuseAdapter(LoggingMixIn, Operations):
         elif rest.startswith(".fffs"):
             return rest, FffsControl(self.fs, self.images, prefix)
         if prefix in self.images:
-            m = ImageMount(self.fs, self.images[prefix], self.store, self.images, prefix, self.transient_paths)
-            print "returning", rest, m
-            return rest, m
+            m = ImageMount(self.fs, self.images[prefix], self.store, self.images, prefix, self.transient_paths, self.readahead)
+            vpath = fffs.VPath(rest)
+            print "returning", vpath, m
+            return vpath, m
 
         raise FuseOSError(ENOENT)
 
@@ -377,6 +419,11 @@ class FuseAdapter(LoggingMixIn, Operations):
         delegate.release(vpath,fh)
         return 0
 
+    def destroy(self, path):
+        if self.readahead is not None:
+            self.readahead.close()
+        self.store.close()
+
     def getxattr(self, path, name, position=0):
         return ''       # Should return ENOATTR
 
@@ -388,9 +435,11 @@ class FuseAdapter(LoggingMixIn, Operations):
 if __name__ == '__main__':
     import logging
     logging.basicConfig(level=logging.DEBUG)
-    if len(sys.argv) != 2:
-        print('usage: %s <mountpoint>' % sys.argv[0])
+    options = sys.argv[2:]
+    if len(sys.argv) < 2 or not set(options) <= set(['--lazy-dirs', '--readahead']):
+        print('usage: %s <mountpoint> [--lazy-dirs] [--readahead]' % sys.argv[0])
         exit(1)
 
     logging.getLogger().setLevel(logging.DEBUG)
-    fuse = FUSE(FuseAdapter(), sys.argv[1], foreground=True, direct_io=True)
+    adapter = FuseAdapter(lazy_dirs=('--lazy-dirs' in options), use_readahead=('--readahead' in options))
+    fuse = FUSE(adapter, sys.argv[1], foreground=True, direct_io=True)
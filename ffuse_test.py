@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import os
+
+from ffuse import *
+from testutil import temp_dir
+
+# fusepy decodes every path it passes to Operations, so these drive the
+# adapter with unicode paths as a real mount would
+
+def test_unicode_paths():
+    with temp_dir() as data_path:
+        adapter = FuseAdapter(data_path)
+        try:
+            adapter.mkdir(u"/img", 0755)
+            adapter.mkdir(u"/img/d", 0755)
+            assert adapter.getattr(u"/img/d") == DIR_ATTRS
+
+            fh = adapter.create(u"/img/d/f", 0644)
+            adapter.write(u"/img/d/f", "data", 0, fh)
+            adapter.release(u"/img/d/f", fh)
+
+            assert adapter.getattr(u"/img/d/f")["st_size"] == 4
+            assert u"f" in adapter.readdir(u"/img/d", None)
+            fh = adapter.open(u"/img/d/f", os.O_RDONLY)
+            assert adapter.read(u"/img/d/f", 4, 0, fh) == "data"
+            adapter.release(u"/img/d/f", fh)
+        finally:
+            adapter.destroy(u"/")
+
+def test_non_ascii_names():
+    with temp_dir() as data_path:
+        adapter = FuseAdapter(data_path)
+        try:
+            adapter.mkdir(u"/img", 0755)
+            adapter.mkdir(u"/img/répertoire", 0755)
+
+            fh = adapter.create(u"/img/répertoire/fichier été", 0644)
+            adapter.write(u"/img/répertoire/fichier été", "data", 0, fh)
+            adapter.release(u"/img/répertoire/fichier été", fh)
+
+            assert u"répertoire" in adapter.readdir(u"/img", None)
+            assert u"fichier été" in adapter.readdir(u"/img/répertoire", None)
+            assert adapter.getattr(u"/img/répertoire/fichier été")["st_size"] == 4
+        finally:
+            adapter.destroy(u"/")
+
+def test_lazy_dirs_remount():
+    with temp_dir() as data_path:
+        adapter = FuseAdapter(data_path, lazy_dirs=True)
+        try:
+            adapter.mkdir(u"/img", 0755)
+            adapter.mkdir(u"/img/d", 0755)
+            fh = adapter.create(u"/img/d/f", 0644)
+            adapter.write(u"/img/d/f", "data", 0, fh)
+            adapter.release(u"/img/d/f", fh)
+        finally:
+            adapter.destroy(u"/")
+
+        adapter = FuseAdapter(data_path, lazy_dirs=True)
+        try:
+            assert u"img" in adapter.readdir(u"/", None)
+            assert u"f" in adapter.readdir(u"/img/d", None)
+            fh = adapter.open(u"/img/d/f", os.O_RDONLY)
+            assert adapter.read(u"/img/d/f", 4, 0, fh) == "data"
+            adapter.release(u"/img/d/f", fh)
+            adapter.mkdir(u"/img/d/e", 0755)
+            assert adapter.getattr(u"/img/d/e") == DIR_ATTRS
+        finally:
+            adapter.destroy(u"/")
+
+def test_readahead_reads():
+    with temp_dir() as data_path:
+        adapter = FuseAdapter(data_path, use_readahead=True)
+        try:
+            adapter.mkdir(u"/img", 0755)
+            data = "".join(chr(i % 251) for i in range(300000))
+            fh = adapter.create(u"/img/f", 0644)
+            adapter.write(u"/img/f", data, 0, fh)
+            adapter.release(u"/img/f", fh)
+
+            fh = adapter.open(u"/img/f", os.O_RDONLY)
+            chunks = []
+            for offset in range(0, len(data), 4096):
+                chunks.append(adapter.read(u"/img/f", 4096, offset, fh))
+            adapter.release(u"/img/f", fh)
+            assert "".join(chunks) == data
+        finally:
+            adapter.destroy(u"/")
@@ -0,0 +1,168 @@
+import collections
+import threading
+from multiprocessing.pool import ThreadPool
+
+# Data files behind fffs File objects are never modified once they have been
+# added to the store, so blocks cached by (path, block index) never go stale.
+
+BLOCK_SIZE = 128 * 1024
+MAX_WINDOW = 16
+CACHE_BLOCKS = 256
+WORKERS = 4
+
+def read_block(path, block_size, block):
+    fd = open(path, "rb")
+    try:
+        fd.seek(block * block_size)
+        return fd.read(block_size)
+    finally:
+        fd.close()
+
+class BlockCache:
+    # bounded LRU of file blocks shared by every open file
+    def __init__(self, max_blocks):
+        self.max_blocks = max_blocks
+        self.blocks = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.blocks.pop(key, None)
+            if data is not None:
+                self.blocks[key] = data
+            return data
+
+    def put(self, key, data):
+        with self.lock:
+            self.blocks.pop(key, None)
+            self.blocks[key] = data
+            while len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last=False)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.blocks
+
+class OpenFile:
+    # tracks the access pattern of a single file handle.  fuse may call read
+    # on one handle from several threads, so fields are only used under lock
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.next_offset = 0
+        self.window = 0
+        # blocks before this one have already been handed to the prefetcher
+        self.prefetched_until = 0
+        # most recently read block, so small reads within it skip the cache
+        self.block = None
+        self.data = None
+
+    def record(self, offset, size):
+        "returns True if this read continues a sequential scan"
+        sequential = offset == self.next_offset
+        if sequential:
+            self.window = min(max(1, self.window * 2), MAX_WINDOW)
+        else:
+            self.window = 0
+        self.next_offset = offset + size
+        return sequential
+
+class Readahead:
+    def __init__(self, block_size=BLOCK_SIZE, cache_blocks=CACHE_BLOCKS, workers=WORKERS, prefetch=True):
+        self.block_size = block_size
+        self.prefetch = prefetch
+        self.cache = BlockCache(cache_blocks)
+        self.pool = ThreadPool(workers)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.open_files = {}
+
+    def open(self, fh, path):
+        with self.lock:
+            self.open_files[fh] = OpenFile(path)
+
+    def release(self, fh):
+        with self.lock:
+            self.open_files.pop(fh, None)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def _fetch(self, key):
+        path, block = key
+        try:
+            data = read_block(path, self.block_size, block)
+            self.cache.put(key, data)
+            return data
+        finally:
+            with self.lock:
+                del self.pending[key]
+
+    def _prefetch(self, path, first_block, count):
+        cached = self.cache.blocks
+        with self.lock:
+            for block in range(first_block, first_block + count):
+                key = (path, block)
+                if key in cached or key in self.pending:
+                    continue
+                self.pending[key] = self.pool.apply_async(self._fetch, (key,))
+
+    def _get_block(self, path, block):
+        key = (path, block)
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+        with self.lock:
+            pending = self.pending.get(key)
+        if pending is not None:
+            return pending.get()
+        data = read_block(path, self.block_size, block)
+        self.cache.put(key, data)
+        return data
+
+    def read(self, fh, path, size, offset):
+        # a single dict lookup is atomic, so only creating an OpenFile locks
+        open_file = self.open_files.get(fh)
+        if open_file is None or open_file.path != path:
+            with self.lock:
+                open_file = self.open_files.get(fh)
+                if open_file is None or open_file.path != path:
+                    open_file = OpenFile(path)
+                    self.open_files[fh] = open_file
+
+        with open_file.lock:
+            return self._read(open_file, path, size, offset)
+
+    def _read(self, open_file, path, size, offset):
+        sequential = open_file.record(offset, size)
+
+        first_block = offset // self.block_size
+        last_block = (offset + size - 1) // self.block_size
+        if not sequential:
+            # a seek starts a new scan; forget how far the old one prefetched
+            open_file.prefetched_until = last_block + 1
+        elif self.prefetch:
+            first_prefetch = max(last_block + 1, open_file.prefetched_until)
+            last_prefetch = last_block + 1 + open_file.window
+            if first_prefetch < last_prefetch:
+                self._prefetch(path, first_prefetch, last_prefetch - first_prefetch)
+                open_file.prefetched_until = last_prefetch
+
+        start = offset - first_block * self.block_size
+        if first_block == last_block:
+            if open_file.block != first_block:
+                open_file.data = self._get_block(path, first_block)
+                open_file.block = first_block
+            return open_file.data[start:start + size]
+
+        chunks = []
+        for block in range(first_block, last_block + 1):
+            data = self._get_block(path, block)
+            chunks.append(data)
+            if len(data) < self.block_size:
+                # reached end of file
+                break
+
+        buffer = "".join(chunks)
+        return buffer[start:start + size]
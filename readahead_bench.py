@@ -0,0 +1,93 @@
+import ctypes
+import ctypes.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import fffs
+import readahead
+
+# Compares sequential read throughput of Filesystem.read, which is what
+# ImageMount.read uses without --readahead, against Readahead with prefetching
+# turned off and on.  The middle case reads the same blocks as the last, so
+# the difference between those two is only the prefetching.  Before each run
+# the files are fsync'd and dropped from the OS page cache with
+# posix_fadvise, so every read which is not prefetched has to go to disk.
+
+FILE_SIZE = 16 * 1024 * 1024
+READ_SIZE = 4096
+FILE_COUNT = 4
+POSIX_FADV_DONTNEED = 4
+
+libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+def evict(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        if libc.posix_fadvise(fd, ctypes.c_long(0), ctypes.c_long(0), POSIX_FADV_DONTNEED) != 0:
+            raise OSError(ctypes.get_errno(), "posix_fadvise failed on %s" % path)
+    finally:
+        os.close(fd)
+
+def make_files(data_dir, fs, image, prefix):
+    for i in range(FILE_COUNT):
+        path = os.path.join(data_dir, "%s-%d" % (prefix, i))
+        with open(path, "wb") as fd:
+            fd.write(os.urandom(FILE_SIZE))
+        image = fs.set_file(image, "%s-%d" % (prefix, i), path)
+    return image
+
+def read_direct(fs, image, vpath, fh, engine):
+    offset = 0
+    while True:
+        data = fs.read(image, vpath, READ_SIZE, offset)
+        if data == "":
+            return offset
+        offset += len(data)
+
+def read_file(fs, image, vpath, fh, engine):
+    path = fs.get_file(image, vpath).path
+    engine.open(fh, path)
+    offset = 0
+    while True:
+        data = engine.read(fh, path, READ_SIZE, offset)
+        if data == "":
+            engine.release(fh)
+            return offset
+        offset += len(data)
+
+def run(name, fs, image, prefix, engine, reader=read_file):
+    for i in range(FILE_COUNT):
+        evict(fs.get_file(image, "%s-%d" % (prefix, i)).path)
+    start = time.time()
+    total = 0
+    for i in range(FILE_COUNT):
+        total += reader(fs, image, "%s-%d" % (prefix, i), i, engine)
+    elapsed = time.time() - start
+    if engine is not None:
+        engine.close()
+    print "%-12s %8.1f MB/s" % (name, total / elapsed / (1024 * 1024))
+
+def main():
+    data_dir = tempfile.mkdtemp()
+    try:
+        store = fffs.Store(data_dir)
+        fs = fffs.Filesystem(store)
+        image = store.new_image(fs.EMPTY_DIR, False)
+        image = make_files(data_dir, fs, image, "direct")
+        image = make_files(data_dir, fs, image, "no-prefetch")
+        image = make_files(data_dir, fs, image, "prefetch")
+
+        run("direct", fs, image, "direct", None, read_direct)
+        run("no-prefetch", fs, image, "no-prefetch", readahead.Readahead(prefetch=False))
+        run("prefetch", fs, image, "prefetch", readahead.Readahead())
+    finally:
+        shutil.rmtree(data_dir)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        FILE_SIZE = int(sys.argv[1]) * 1024 * 1024
+    main()
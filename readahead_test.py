@@ -0,0 +1,108 @@
+import threading
+
+from readahead import *
+from testutil import temp_dir, make_data_file
+
+def make_pattern_file(dir, size):
+    return make_data_file(dir, "".join(chr(i % 251) for i in range(size)))
+
+def test_sequential_read_matches_file():
+    with temp_dir() as dir:
+        path = make_pattern_file(dir, 10000)
+        expected = open(path, "rb").read()
+        r = Readahead(block_size=1024, cache_blocks=4)
+        try:
+            r.open(1, path)
+            buffer = []
+            offset = 0
+            while True:
+                data = r.read(1, path, 300, offset)
+                if data == "":
+                    break
+                buffer.append(data)
+                offset += len(data)
+        finally:
+            r.close()
+        assert "".join(buffer) == expected
+
+def test_random_read_matches_file():
+    with temp_dir() as dir:
+        path = make_pattern_file(dir, 10000)
+        expected = open(path, "rb").read()
+        r = Readahead(block_size=1024, cache_blocks=4)
+        try:
+            r.open(1, path)
+            for offset, size in [(9000, 2000), (5, 10), (1020, 10), (4096, 0), (3000, 3000)]:
+                assert r.read(1, path, size, offset) == expected[offset:offset+size]
+        finally:
+            r.close()
+
+def test_sequential_read_prefetches():
+    with temp_dir() as dir:
+        path = make_pattern_file(dir, 10000)
+        r = Readahead(block_size=1024, cache_blocks=16)
+        try:
+            r.open(1, path)
+            r.read(1, path, 1024, 0)
+            r.read(1, path, 1024, 1024)
+        finally:
+            r.close()
+        assert (path, 2) in r.cache
+
+def test_random_read_does_not_prefetch():
+    with temp_dir() as dir:
+        path = make_pattern_file(dir, 10000)
+        r = Readahead(block_size=1024, cache_blocks=16)
+        try:
+            r.open(1, path)
+            r.read(1, path, 10, 5000)
+        finally:
+            r.close()
+        assert (path, 5) not in r.cache
+
+def test_cache_is_bounded():
+    cache = BlockCache(2)
+    cache.put(("a", 0), "x")
+    cache.put(("a", 1), "y")
+    cache.get(("a", 0))
+    cache.put(("a", 2), "z")
+    assert ("a", 0) in cache
+    assert ("a", 1) not in cache
+    assert ("a", 2) in cache
+
+def test_rescan_after_seek_prefetches():
+    with temp_dir() as dir:
+        path = make_pattern_file(dir, 100000)
+        r = Readahead(block_size=1024, cache_blocks=16)
+        try:
+            r.open(1, path)
+            for offset in range(0, 32 * 1024, 1024):
+                r.read(1, path, 1024, offset)
+            r.read(1, path, 10, 90000)
+            r.cache = BlockCache(16)
+            r.read(1, path, 1024, 0)
+            r.read(1, path, 1024, 1024)
+        finally:
+            r.close()
+        assert (path, 2) in r.cache
+
+def test_concurrent_reads_on_one_handle():
+    with temp_dir() as dir:
+        path = make_pattern_file(dir, 100000)
+        expected = open(path, "rb").read()
+        r = Readahead(block_size=1024, cache_blocks=8)
+        errors = []
+        def scan(start):
+            for offset in range(start, len(expected), 700):
+                if r.read(1, path, 700, offset) != expected[offset:offset+700]:
+                    errors.append(offset)
+        try:
+            r.open(1, path)
+            threads = [threading.Thread(target=scan, args=(i * 350,)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            r.close()
+        assert errors == []
@@ -0,0 +1,20 @@
+import contextlib
+import os
+import shutil
+import tempfile
+
+# helpers shared by the *_test.py files
+
+@contextlib.contextmanager
+def temp_dir():
+    path = tempfile.mkdtemp()
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path)
+
+def make_data_file(dir, data):
+    fd, path = tempfile.mkstemp(dir=dir)
+    os.write(fd, data)
+    os.close(fd)
+    return path